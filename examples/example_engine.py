@@ -4,16 +4,26 @@
 Example chess engine just to test the UCI library.
 
 It just returns a random legal move, after waiting for the entire time limit to pass.
+
+If rust-chess is installed it is used for move generation, since it is much faster than
+python-chess. Otherwise this falls back to python-chess.
 """
 
+import math
 import random
 import time
-from queue import Queue
-from typing import Callable
-import chess
+from queue import Queue, Empty
+try:
+    import rust_chess as chess
+except ImportError:
+    import chess
 
 from chess_interface import UCI
 
+# Random number generator for move_search. UCI runs every search on the same thread, so this is
+# only ever used from that thread, and doesn't share state with the random module
+rng = random.Random()
+
 def move_search(
         position: str,
         time_limit: int,
@@ -25,32 +35,51 @@ def move_search(
     Waits for the stop command or the time to expire, and then sends a random legal move
     """
     # Parse the position
-    board = chess.Board()
-    if position != "startpos":
-        board.set_fen(position)
-
-    # Generate all legal moves
-    legal_moves = list(board.legal_moves)
-
-    # Wait for the time limit to pass or to receive a stop command from the recv_queue
-    start_time = time.time()
-    while time.time() - start_time < time_limit:
-        if not recv_queue.empty():
-            command = recv_queue.get()
-            if command == "stop":
+    if position == "startpos":
+        board = chess.Board()
+    else:
+        board = chess.Board(position)
+
+    # Pick a random legal move in one pass over the generator, without building a list of them.
+    # Each move replaces the choice with probability 1 / (number of moves seen so far), which
+    # leaves every move equally likely. generate_legal_moves works with rust-chess and python-chess
+    move = None
+    for i, legal_move in enumerate(board.generate_legal_moves()):
+        if rng.randrange(i + 1) == 0:
+            move = legal_move
+
+    # Wait for the time limit to pass or to receive a stop command from the recv_queue.
+    # The time limit is given in milliseconds, and may be infinite. Use the monotonic clock in
+    # integer nanoseconds, so the deadline isn't moved by changes to the system clock
+    deadline = None
+    if time_limit != math.inf:
+        deadline = time.monotonic_ns() + int(time_limit) * 1_000_000
+    while True:
+        timeout = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic_ns()
+            if remaining <= 0:
                 break
+            timeout = remaining / 1_000_000_000
+        try:
+            # Block on the queue instead of polling it, so we don't burn CPU while waiting
+            command = recv_queue.get(timeout=timeout)
+        except Empty:
+            break
+        if command == "stop":
+            break
 
-    # Pick a random move
-    move = random.choice(legal_moves)
-    send_queue.put(str(move))
+    # Send the move, or the null move if there are no legal moves
+    send_queue.put("0000" if move is None else str(move))
 
 if __name__ == "__main__":
     print("Chess Interface Test Engine by Jacob MacMillan Software Inc.")
     interface = UCI(move_search)
-    while True:
-        command = interface.read()
+    # Open the log file once, and line buffer it so each command is still written out right away
+    with open("log.txt", "a", buffering=1) as log:
+        while True:
+            command = interface.read()
 
-        # Save the command to the log file for debugging
-        with open("log.txt", "a") as log:
+            # Save the command to the log file for debugging
             log.write(command + "\n")
-        interface.check_best_move()
+            interface.check_best_move()
@@ -3,11 +3,6 @@
 """
 Library for UCI chess engine communication.
 """
-import os
-import sys
 
-__all__ = ['UCI']
-from .main import UCI
-
-PROJECT_PATH = os.getcwd()
-sys.path.append(PROJECT_PATH)
+__all__ = ['UCI', 'parallel_search']
+from .main import UCI, parallel_search
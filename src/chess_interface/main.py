@@ -23,14 +23,37 @@ with this library.  If not, see <http://www.gnu.org/licenses/>.
 Author: 2024, Jacob MacMillan Software Inc. (Jacob MacMillan)
 """
 
+import os
 import sys
-import time
 import math
+import functools
+import multiprocessing
+import selectors
+from concurrent.futures import ProcessPoolExecutor
 from queue import Queue
 from typing import Callable
 import threading
+import traceback
 import chess
 
+# Responses the GUI waits for. Output is only flushed after one of these, so anything sent
+# before them (such as id and info lines) goes out in the same write
+_FLUSH_RESPONSES = ("uciok", "readyok", "bestmove", "copyprotection", "registration")
+
+def _drain_queue(queue: Queue):
+    """
+    Discards everything in the queue, taking its lock only once instead of once per item.
+
+    :param queue: The queue to empty
+    :return: None
+    """
+
+    with queue.mutex:
+        queue.queue.clear()
+        queue.unfinished_tasks = 0
+        queue.all_tasks_done.notify_all()
+        queue.not_full.notify_all()
+
 # The UCI class is the main class that you will use to interact with the engine.
 # It must take the move search function as an argument, and that function is expected to be able
 # to handle the "go" and "stop" commands, as well as adhere to any time limits that are set.
@@ -39,25 +62,73 @@ import chess
 # and a Queue to recieve messages so it can know if  the stop command was sent,
 # and also to send the current best move to the UCI class.
 # Any return value is ignored, and the best move is sent to the UCI class via the Queue.
+# The move search function must put exactly one reply on the Queue before it returns, either just
+# the move or a (move, ponder) tuple. If it returns or raises without one, the null move "0000"
+# is sent as the best move.
+# If position_as_board is True, the move search function is given a copy of the current
+# chess.Board instead of a fen string, which saves converting the position to a fen string
+# and back again for engines that use python-chess.
 # Everything else is handled by the UCI class.
 
 class UCI:
     def __init__(
             self,
-            move_search: Callable[[str, int, int, Queue, Queue], None],
+            move_search: Callable[[str | chess.Board, int, int, Queue, Queue], None],
             author: str = "(UCI Implementation) Jacob MacMillan Software Inc.",
-            engine_name: str = "UCI Chess Engine"
+            engine_name: str = "UCI Chess Engine",
+            position_as_board: bool = False
             ):
         self.move_search = move_search
+        self.position_as_board = position_as_board # Give move_search a chess.Board, not a fen
         self.best_move = None # The best move found by the engine so far, in UCI format
-        self.position = chess.Board().fen() # Starting position
+        self.board = chess.Board() # Current position, kept between position commands
+        self._last_base = "startpos" # Starting position of the last position command
+        self._last_moves = () # Moves played from _last_base in the last position command
         self.time_limit = 0 # Time limit in milliseconds
         self.send_queue = Queue() # Queue used to send information to the engine
         self.recv_queue = Queue() # Queue used to recieve information from the engine
         self.max_depth = 0
         self.author = author
         self.engine_name = engine_name
+        # A single search thread is kept running, and is handed each search through _search_job
         self.move_thread = None
+        self._search_cv = threading.Condition()
+        self._search_job = None # Arguments for the next move_search call
+        self._searching = False # True from "go" until move_search returns
+        # Pipe the search thread writes to when it finishes, so read() can wake up for it.
+        # This is only created once read() starts waiting on stdin with a selector
+        self._wake_read = None
+        self._wake_write = None
+        self._selector = None
+        self._stdin_buffer = b""
+        # Handler for each command, looked up by the command's first word
+        self._handlers = {
+            "uci": self._uci,
+            "isready": self._isready,
+            "position": self._position,
+            "go": self._go,
+            "stop": self._stop,
+            "ucinewgame": self._ucinewgame,
+            "setoption": self._setoption,
+            "quit": self._quit,
+        }
+
+    @property
+    def position(self) -> str:
+        """
+        The current position as a fen string. This is only built when it is asked for.
+        """
+
+        return self.board.fen()
+
+    @position.setter
+    def position(self, position: str):
+        if position == "startpos":
+            self.board = chess.Board()
+        else:
+            self.board = chess.Board(position)
+        self._last_base = position
+        self._last_moves = ()
 
     def read(self) -> str:
         """
@@ -66,15 +137,141 @@ class UCI:
 
         Ignore invalid/empty commands
 
+        While waiting for input, this also outputs the best move as soon as the search finishes,
+        instead of waiting for the next command to arrive.
+
         :return: None
         """
 
-        command = input().strip()
+        command = self._read_line().strip()
 
         self.process_command(command)
 
         return command
 
+    def _read_line(self) -> str:
+        """
+        Waits for a full line on stdin, and outputs the best move if the search finishes first.
+
+        Falls back to input() if stdin can't be waited on (e.g. on Windows, or if it isn't a file)
+
+        :return: The line, without the trailing newline
+        """
+
+        if self._selector is None:
+            try:
+                if os.name == "nt":
+                    raise OSError("Can't select on stdin on Windows")
+                selector = selectors.DefaultSelector()
+                selector.register(sys.stdin.fileno(), selectors.EVENT_READ)
+                wake_read, wake_write = os.pipe()
+                os.set_blocking(wake_read, False)
+                os.set_blocking(wake_write, False)
+                selector.register(wake_read, selectors.EVENT_READ)
+                self._wake_read, self._wake_write = wake_read, wake_write
+                self._selector = selector
+            except (AttributeError, OSError, ValueError):
+                # io.UnsupportedOperation is a subclass of OSError and ValueError
+                self._selector = False
+        if self._selector is False:
+            return input()
+
+        while b"\n" not in self._stdin_buffer:
+            for key, _ in self._selector.select():
+                if key.fd == self._wake_read:
+                    self._finish_search()
+                else:
+                    data = os.read(key.fd, 4096)
+                    if not data:
+                        # Like input(), return a last line with no newline, and only fail after it
+                        if not self._stdin_buffer:
+                            raise EOFError
+                        line, self._stdin_buffer = self._stdin_buffer, b""
+                        return line.decode()
+                    self._stdin_buffer += data
+
+        line, self._stdin_buffer = self._stdin_buffer.split(b"\n", 1)
+        return line.decode()
+
+    def _finish_search(self):
+        """
+        Called when the search thread signals that it has finished. Outputs the best move.
+
+        :return: None
+        """
+
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        self.check_best_move()
+
+    def _search_loop(self):
+        """
+        Runs on the search thread. Waits for a search to be started, runs the move search
+        function, and then wakes up read()
+
+        :return: None
+        """
+
+        while True:
+            with self._search_cv:
+                while self._search_job is None:
+                    self._search_cv.wait()
+                job = self._search_job
+                self._search_job = None
+
+            try:
+                self.move_search(*job)
+            except Exception: # pylint: disable=broad-exception-caught
+                # Report the error, but keep the thread running for the next search
+                traceback.print_exc()
+
+            # Every search gives exactly one reply. Nothing takes from the recv_queue while the
+            # search is running, so if it is empty the search finished (or failed) without giving
+            # a move, and the null move is sent instead
+            if self.recv_queue.empty():
+                self.recv_queue.put("0000")
+
+            with self._search_cv:
+                self._searching = False
+                self._search_cv.notify_all()
+            if self._wake_write is not None:
+                try:
+                    os.write(self._wake_write, b"\0")
+                except BlockingIOError:
+                    # read() hasn't emptied the pipe yet, so it will still be woken up
+                    pass
+
+    def _start_search(self, *args):
+        """
+        Hands a search to the search thread, starting the thread if it isn't running yet
+
+        :return: None
+        """
+
+        if self.move_thread is None:
+            self.move_thread = threading.Thread(target=self._search_loop, daemon=True)
+            self.move_thread.start()
+
+        with self._search_cv:
+            self._searching = True
+            self._search_job = args
+            self._search_cv.notify()
+
+    def _wait_for_search(self):
+        """
+        Blocks until the current search, if any, has finished
+
+        :return: None
+        """
+
+        with self._search_cv:
+            while self._searching:
+                self._search_cv.wait()
+
     def process_command(self, command: str):
         """
         Processes a single command from the engine.
@@ -86,102 +283,173 @@ class UCI:
         :return: None
         """
 
-        if command == "uci":
-            self.send("id name " + self.engine_name)
-            self.send("id author " + self.author)
-            self.send("uciok")
-        elif command == "isready":
-            self.send("readyok")
-        elif command.startswith("position"):
-            # Constrcut the position fen based on the starting position fen plus any given moves
-            args = command.split(" ")
-
-            chess_board = chess.Board()
-
-            if args[1] == "fen":
-                self.position = " ".join(args[2:8])
-                chess_board = chess.Board(self.position)
-                if len(args) > 8 and args[8] == "moves":
-                    for i in range(9, len(args)):
-                        chess_board.push(chess.Move.from_uci(args[i]))
-            elif args[1] == "startpos":
-                if len(args) > 2 and args[2] == "moves":
-                    for i in range(3, len(args)):
-                        chess_board.push(chess.Move.from_uci(args[i]))
-
-            self.position = chess.Board().fen()
-
-            self.position = chess_board.fen()
-        elif command.startswith("go"):
-            # Clear queues and kill the thread if it is running
-            if self.move_thread is not None:
-                self.send_queue.put("stop")
-                self.move_thread.join()
-                self.move_thread = None
-            while not self.send_queue.empty():
-                self.send_queue.get()
-            while not self.recv_queue.empty():
-                self.recv_queue.get()
-
-            # Parse the arguments
-            args = command.split(" ")
-            time_limit = math.inf
-            max_depth = 100
-
-            for i in range(1, len(args)):
-                if args[i] == "movetime":
-                    time_limit = int(args[i + 1]) 
-                elif args[i] == "depth":
-                    max_depth = int(args[i + 1])
-                elif args[i] == "infinite":
-                    time_limit = math.inf
-                # TODO: Need to handle time control information
-                # winc, binc, wtime, btime, movestogo
-                # TODO: need to handle ponder, mate, and searchmoves
-
-            # Start the move search on a new thread
-            self.move_thread = threading.Thread(
-                target=self.move_search,
-                args=(self.position, time_limit, max_depth, self.recv_queue, self.send_queue)
-            )
+        # Split the command once, and look up the handler for its first word.
+        # Unknown and empty commands are ignored
+        args = command.split()
+        handler = self._handlers.get(args[0]) if args else None
+        if handler is not None:
+            handler(args)
 
-            self.move_thread.start()
+    def _uci(self, _args: list[str]):
+        """
+        Handles "uci" by identifying the engine
+
+        :param _args: The command, split into words
+        :return: None
+        """
+
+        self.send("id name " + self.engine_name)
+        self.send("id author " + self.author)
+        self.send("uciok")
+
+    def _isready(self, _args: list[str]):
+        """
+        Handles "isready"
 
-        elif command.startswith("stop"):
+        :param _args: The command, split into words
+        :return: None
+        """
+
+        self.send("readyok")
+
+    def _position(self, args: list[str]):
+        """
+        Handles "position" by setting up the board
+
+        :param args: The command, split into words
+        :return: None
+        """
+
+        # Construct the position based on the starting position plus any given moves
+        # The fen may leave off its last fields, so find where the moves start instead of
+        # assuming the fen is always six words long
+        try:
+            moves_index = args.index("moves")
+        except ValueError:
+            moves_index = len(args)
+        moves = tuple(args[moves_index + 1:])
+
+        base = "startpos"
+        if args[1] == "fen":
+            base = " ".join(args[2:moves_index])
+
+        # GUIs resend the whole game every move, so if this continues the last position
+        # we only need to play the new moves on the board we already have
+        played = len(self._last_moves)
+        if base != self._last_base or moves[:played] != self._last_moves:
+            self.position = base
+            played = 0
+
+        push = self.board.push
+        from_uci = chess.Move.from_uci
+        # If a move fails, the board has only some of the moves on it. Forget what the board
+        # holds until every move is on it, so the next position command rebuilds it
+        self._last_base = None
+        for move in moves[played:]:
+            push(from_uci(move))
+        self._last_base = base
+        self._last_moves = moves
+
+    def _go(self, args: list[str]):
+        """
+        Handles "go" by starting a new search
+
+        :param args: The command, split into words
+        :return: None
+        """
+
+        # Stop the current search if there is one, and clear the queues
+        if self._searching:
             self.send_queue.put("stop")
-            # Wait until the recv_queue has a message in it, and then kill the thread
-            while self.recv_queue.empty():
-                time.sleep(0.1)
-            self.best_move = self.recv_queue.get()
+            self._wait_for_search()
+        _drain_queue(self.send_queue)
+        _drain_queue(self.recv_queue)
+
+        # Parse the arguments, mapping each word to the word after it so values can be looked up
+        options = dict(zip(args[1:], args[2:]))
+        time_limit = math.inf
+        max_depth = 100
+
+        if "movetime" in options:
+            time_limit = int(options["movetime"])
+        if "depth" in options:
+            max_depth = int(options["depth"])
+        if "infinite" in args:
+            time_limit = math.inf
+        # TODO: Need to handle time control information
+        # winc, binc, wtime, btime, movestogo
+        # TODO: need to handle ponder, mate, and searchmoves
 
-            # Make sure the thread is dead
-            self.move_thread.join()
-
-            # Output the best move
-            # Use just bestmove if the value is a str, or bestmove and ponder if it is a tuple or list
-            if isinstance(self.best_move, str):
-                self.send("bestmove " + self.best_move)
-            elif isinstance(self.best_move, (list, tuple)):
-                self.send("bestmove " + self.best_move[0] + " ponder " + self.best_move[1])
-        elif command.startswith("ucinewgame"):
-            self.position = "startpos"
-        elif command.startswith("setoption"):
-            # This is very engine specific, so we will just ignore it for now
-            pass
-        elif command.startswith("quit"):
-            sys.exit(0)
+        # Copy the board so the search thread has its own, which is cheaper than a fen round trip
+        if self.position_as_board:
+            position = self.board.copy(stack=False)
         else:
-            pass
+            position = self.position
+
+        # Start the move search on the search thread
+        self._start_search(position, time_limit, max_depth, self.recv_queue, self.send_queue)
+
+    def _stop(self, _args: list[str]):
+        """
+        Handles "stop" by stopping the search and outputting its best move
+
+        :param _args: The command, split into words
+        :return: None
+        """
+
+        if not self._searching and self.recv_queue.empty():
+            # No search is running (or its result was already sent), so there is nothing to wait for
+            return
+        if self._searching:
+            self.send_queue.put("stop")
+
+        # Wait for the search to finish, and then take the best move it put in the recv_queue.
+        # The search thread always leaves one there, so this never has to wait on the queue
+        self._wait_for_search()
+        self.best_move = self.recv_queue.get_nowait()
+
+        # Output the best move
+        self._send_best_move()
+
+    def _ucinewgame(self, _args: list[str]):
+        """
+        Handles "ucinewgame" by going back to the starting position
+
+        :param _args: The command, split into words
+        :return: None
+        """
+
+        self.position = "startpos"
+
+    def _setoption(self, _args: list[str]):
+        """
+        Handles "setoption". This is very engine specific, so we will just ignore it for now
+
+        :param _args: The command, split into words
+        :return: None
+        """
+
+    def _quit(self, _args: list[str]):
+        """
+        Handles "quit" by closing the program
+
+        :param _args: The command, split into words
+        :return: None
+        """
+
+        sys.exit(0)
 
     def send(self, text: str):
         """
-        Prints output to stdout
+        Prints output to stdout. Output is buffered until a response the GUI waits for is sent.
 
         :param command: The command to send
         :return: None
         """
 
-        print(text, flush=True)
+        sys.stdout.write(text + "\n")
+        if text.startswith(_FLUSH_RESPONSES):
+            sys.stdout.flush()
 
     def check_best_move(self):
         """
@@ -189,16 +457,108 @@ class UCI:
         return True, otherwise return False.
         """
 
-        if self.move_thread is not None:
-            if self.move_thread.is_alive():
-                return False
-            self.move_thread.join()
-            self.move_thread = None
+        if self._searching:
+            return False
         if not self.recv_queue.empty():
             self.best_move = self.recv_queue.get()
-            if isinstance(self.best_move, str):
-                self.send("bestmove " + self.best_move)
-            elif isinstance(self.best_move, (list, tuple)):
-                self.send("bestmove " + self.best_move[0] + " ponder " + self.best_move[1])
+            self._send_best_move()
             return True
         return False
+
+    def _send_best_move(self):
+        """
+        Outputs self.best_move. The engine may give either just the move (as a str, chess.Move,
+        or anything else that converts to UCI format with str()), or a (move, ponder) tuple or
+        list, where ponder may be None.
+
+        :return: None
+        """
+
+        best_move = self.best_move
+        if not isinstance(best_move, (list, tuple)):
+            best_move = (best_move, None)
+        move, ponder = best_move
+
+        self.send(f"bestmove {move}" if ponder is None else f"bestmove {move} ponder {ponder}")
+
+@functools.lru_cache(maxsize=None)
+def _get_search_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Returns the process pool used by parallel_search, creating it the first time it is asked for.
+
+    parallel_search runs on the search thread, and forking a process that has other threads
+    running can deadlock, so the workers are started without forking the engine.
+
+    :param workers: The number of worker processes in the pool
+    :return: The process pool
+    """
+
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+def _evaluate_moves(
+        evaluate: Callable[[str, str, int], float],
+        fen: str,
+        moves: list[str],
+        max_depth: int
+        ) -> tuple[float, str]:
+    """
+    Runs in a worker process. Scores each of the moves, and returns the best one.
+
+    :param evaluate: The function used to score a move
+    :param fen: The position the moves are played from
+    :param moves: The moves to score, in UCI format
+    :param max_depth: The max depth to search each move to
+    :return: The best score and its move
+    """
+
+    return max((evaluate(fen, move, max_depth), move) for move in moves)
+
+def parallel_search(
+        evaluate: Callable[[str, str, int], float],
+        position: str | chess.Board,
+        max_depth: int,
+        workers: int | None = None
+        ) -> str | None:
+    """
+    Scores every legal move in the position on a pool of worker processes, so the search isn't
+    limited to one core by the GIL, and returns the move with the highest score.
+
+    The legal moves are split evenly between the workers, and each worker sends back only its
+    best move. The pool is created the first time this is called, and reused after that (a
+    separate pool is kept for each number of workers asked for).
+
+    evaluate is called as evaluate(fen, move, max_depth), with the move in UCI format, and must
+    return a score for the side to move, where higher is better. It has to be defined at the top
+    level of a module, so it can be sent to the worker processes.
+
+    This blocks until every move has been scored, so max_depth should be chosen to fit within
+    the time limit.
+
+    :param evaluate: The function used to score a move
+    :param position: The position to search, as a fen string or a chess.Board
+    :param max_depth: The max depth passed to evaluate
+    :param workers: The number of worker processes to use. Defaults to the number of CPUs
+    :return: The best move in UCI format, or None if there are no legal moves
+    """
+
+    workers = workers or os.cpu_count() or 1
+    pool = _get_search_pool(workers)
+
+    board = position if isinstance(position, chess.Board) else chess.Board(position)
+    fen = board.fen()
+    moves = [move.uci() for move in board.legal_moves]
+    if not moves:
+        return None
+
+    chunks = min(workers, len(moves))
+    futures = [
+        pool.submit(_evaluate_moves, evaluate, fen, moves[i::chunks], max_depth)
+        for i in range(chunks)
+    ]
+
+    _, best_move = max(future.result() for future in futures)
+    return best_move
@@ -0,0 +1,45 @@
+"""
+Tests for parallel_search.
+"""
+
+import chess
+
+from chess_interface import parallel_search
+
+PIECE_VALUES = {
+    chess.PAWN: 1,
+    chess.KNIGHT: 3,
+    chess.BISHOP: 3,
+    chess.ROOK: 5,
+    chess.QUEEN: 9,
+}
+
+def capture_value(fen: str, move: str, max_depth: int) -> float:
+    """
+    Scores a move by the value of the piece it captures. This is defined at the top level of the
+    module so it can be sent to the worker processes.
+    """
+
+    captured = chess.Board(fen).piece_at(chess.Move.from_uci(move).to_square)
+    return PIECE_VALUES[captured.piece_type] if captured else 0
+
+def test_parallel_search_picks_best_capture():
+    fen = "4k3/8/8/1n1q4/4P3/8/8/4K3 w - - 0 1"
+
+    assert parallel_search(capture_value, fen, 1, workers=2) == "e4d5"
+
+def test_parallel_search_accepts_board():
+    board = chess.Board("4k3/8/8/1n1q4/4P3/8/8/4K3 w - - 0 1")
+
+    assert parallel_search(capture_value, board, 1, workers=2) == "e4d5"
+
+def test_parallel_search_more_workers_than_moves():
+    # The only legal move is the king taking the rook
+    fen = "7k/6R1/8/8/8/8/8/K7 b - - 0 1"
+
+    assert parallel_search(capture_value, fen, 1, workers=4) == "h8g7"
+
+def test_parallel_search_no_legal_moves():
+    fen = "7k/5Q2/6K1/8/8/8/8/8 b - - 0 1"
+
+    assert parallel_search(capture_value, fen, 1, workers=2) is None
@@ -0,0 +1,192 @@
+"""
+Tests for command handling in the UCI class.
+"""
+
+import math
+import chess
+import pytest
+
+from chess_interface import UCI
+
+FEN = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+
+def expected_fen(start: str, moves: list[str]) -> str:
+    """
+    Builds the position from scratch, to compare against the cached board
+    """
+
+    board = chess.Board() if start == "startpos" else chess.Board(start)
+    for move in moves:
+        board.push_uci(move)
+    return board.fen()
+
+def record_search(calls: list):
+    """
+    Returns a move search function that records its arguments, and replies with a fixed move
+    """
+
+    def move_search(position, time_limit, max_depth, send_queue, recv_queue):
+        calls.append((position, time_limit, max_depth))
+        send_queue.put("e2e4")
+
+    return move_search
+
+def wait_for_stop(position, time_limit, max_depth, send_queue, recv_queue):
+    """
+    Move search function that only replies once it is told to stop
+    """
+
+    while recv_queue.get() != "stop":
+        pass
+    send_queue.put(("e2e4", "e7e5"))
+
+def raise_after_stop(position, time_limit, max_depth, send_queue, recv_queue):
+    """
+    Move search function that fails once it is told to stop, without giving a move
+    """
+
+    while recv_queue.get() != "stop":
+        pass
+    raise RuntimeError("search failed")
+
+def no_reply(position, time_limit, max_depth, send_queue, recv_queue):
+    """
+    Move search function that returns without giving a move
+    """
+
+def test_position_extends_cached_board():
+    uci = UCI(None)
+    uci.process_command("position startpos moves e2e4")
+    board = uci.board
+
+    uci.process_command("position startpos moves e2e4 e7e5 g1f3")
+
+    assert uci.board is board
+    assert uci.position == expected_fen("startpos", ["e2e4", "e7e5", "g1f3"])
+
+def test_position_takeback_rebuilds_board():
+    uci = UCI(None)
+    uci.process_command("position startpos moves e2e4 e7e5 g1f3")
+
+    uci.process_command("position startpos moves e2e4 c7c5")
+
+    assert uci.position == expected_fen("startpos", ["e2e4", "c7c5"])
+
+def test_position_new_fen_rebuilds_board():
+    uci = UCI(None)
+    uci.process_command("position startpos moves e2e4")
+
+    uci.process_command(f"position fen {FEN} moves e7e5")
+    assert uci.position == expected_fen(FEN, ["e7e5"])
+
+    uci.process_command("position startpos moves d2d4")
+    assert uci.position == expected_fen("startpos", ["d2d4"])
+
+def test_position_short_fen_with_moves():
+    uci = UCI(None)
+
+    uci.process_command("position fen 7k/8/8/8/8/8/8/K7 w moves a1a2 h8g8")
+
+    assert uci.position == expected_fen("7k/8/8/8/8/8/8/K7 w - - 0 1", ["a1a2", "h8g8"])
+
+def test_position_recovers_after_bad_move():
+    uci = UCI(None)
+    uci.process_command("position startpos moves e2e4")
+    with pytest.raises(ValueError):
+        uci.process_command("position startpos moves e2e4 e7e5 zz")
+
+    uci.process_command("position startpos moves e2e4 e7e5 g1f3")
+
+    assert uci.position == expected_fen("startpos", ["e2e4", "e7e5", "g1f3"])
+
+def test_ucinewgame_resets_position():
+    uci = UCI(None)
+    uci.process_command("position startpos moves e2e4")
+
+    uci.process_command("ucinewgame")
+
+    assert uci.position == chess.STARTING_FEN
+
+@pytest.mark.parametrize("command, time_limit, max_depth", [
+    ("go", math.inf, 100),
+    ("go movetime 500", 500, 100),
+    ("go depth 7", math.inf, 7),
+    ("go depth 3 movetime 250", 250, 3),
+    ("go movetime 250 infinite", math.inf, 100),
+    ("go infinite", math.inf, 100),
+])
+def test_go_options(command, time_limit, max_depth, capsys):
+    calls = []
+    uci = UCI(record_search(calls))
+    uci.process_command("position startpos moves e2e4")
+
+    uci.process_command(command)
+    uci._wait_for_search()
+
+    assert calls == [(expected_fen("startpos", ["e2e4"]), time_limit, max_depth)]
+    assert uci.check_best_move()
+    assert capsys.readouterr().out == "bestmove e2e4\n"
+
+def test_go_passes_board_copy():
+    calls = []
+    uci = UCI(record_search(calls), position_as_board=True)
+    uci.process_command("position startpos moves e2e4")
+
+    uci.process_command("go")
+    uci._wait_for_search()
+
+    position = calls[0][0]
+    assert isinstance(position, chess.Board)
+    assert position is not uci.board
+    assert position.fen() == uci.position
+
+def test_stop_without_search_does_nothing(capsys):
+    uci = UCI(record_search([]))
+
+    uci.process_command("stop")
+
+    assert capsys.readouterr().out == ""
+
+def test_stop_sends_best_move_once(capsys):
+    uci = UCI(wait_for_stop)
+    uci.process_command("go infinite")
+
+    uci.process_command("stop")
+    uci.process_command("stop")
+
+    assert capsys.readouterr().out == "bestmove e2e4 ponder e7e5\n"
+    assert not uci.check_best_move()
+
+def test_unknown_and_empty_commands_are_ignored(capsys):
+    uci = UCI(None)
+
+    uci.process_command("")
+    uci.process_command("foo bar")
+    uci.process_command("  isready  ")
+
+    assert capsys.readouterr().out == "readyok\n"
+
+def test_stop_returns_when_search_raises(capsys):
+    uci = UCI(raise_after_stop)
+    uci.process_command("go infinite")
+
+    uci.process_command("stop")
+
+    assert capsys.readouterr().out == "bestmove 0000\n"
+    assert not uci._searching
+
+def test_stop_returns_when_search_gives_no_move(capsys):
+    uci = UCI(no_reply)
+    uci.process_command("go infinite")
+
+    uci.process_command("stop")
+
+    assert capsys.readouterr().out == "bestmove 0000\n"
+
+def test_check_best_move_when_search_gives_no_move(capsys):
+    uci = UCI(no_reply)
+    uci.process_command("go")
+    uci._wait_for_search()
+
+    assert uci.check_best_move()
+    assert capsys.readouterr().out == "bestmove 0000\n"